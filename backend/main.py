@@ -1,24 +1,39 @@
+import asyncio
+import functools
 import logging
 import os
-import time
 import json
-from io import BytesIO, StringIO
+import random
+import string
+import time
+from collections import namedtuple
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional, Set
 
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pac
 import requests
+import urllib3
 from dotenv import load_dotenv
 from fastapi import FastAPI, File, Form, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------------------------------------------------
 # Environment loading (SAFE for Cloud Run)
 # ---------------------------------------------------
 
 BASE_DIR = Path(__file__).resolve().parent
-load_dotenv(BASE_DIR / ".env")
-load_dotenv()
+load_dotenv(BASE_DIR / ".env", override=False)
+if not os.getenv("FRESHDESK_DOMAIN"):
+    # Fall back to a .env found from the working directory
+    load_dotenv()
 
 logger = logging.getLogger("freshdesk")
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -35,7 +50,11 @@ def mask(text: Optional[str]) -> str:
 # FastAPI app
 # ---------------------------------------------------
 
-app = FastAPI(title="Bulk Freshdesk Mailer", version="1.0.0")
+app = FastAPI(
+    title="Bulk Freshdesk Mailer",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -58,28 +77,220 @@ def build_base_url(domain: str) -> str:
         return f"https://{domain.rstrip('/')}/api/v2"
     return f"https://{domain}.freshdesk.com/api/v2"
 
-# Global vars (Safe Initialization)
-FRESHDESK_DOMAIN = os.getenv("FRESHDESK_DOMAIN", "")
-FRESHDESK_API_KEY = os.getenv("FRESHDESK_API_KEY", "")
-BASE_URL = build_base_url(FRESHDESK_DOMAIN)
-AUTH = (FRESHDESK_API_KEY, "X")
-HEADERS = {"Content-Type": "application/json"}
+Env = namedtuple("Env", "domain api_key base_url auth headers")
+
+@functools.lru_cache(maxsize=1)
+def _env() -> Env:
+    """Freshdesk settings, read from the environment once per process."""
+    domain = os.getenv("FRESHDESK_DOMAIN", "")
+    api_key = os.getenv("FRESHDESK_API_KEY", "")
+    return Env(
+        domain=domain,
+        api_key=api_key,
+        base_url=build_base_url(domain),
+        auth=(api_key, "X"),
+        headers={"Content-Type": "application/json"},
+    )
+
+# Max in-flight ticket POSTs per bulk run
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "10"))
+# Rows rendered and scheduled ahead of completion; bounds per-run task/result memory
+SEND_WINDOW_SIZE = int(os.getenv("SEND_WINDOW_SIZE", "20"))
+
+# Freshdesk per-minute API quota (shared across all bulk runs in this process)
+FRESHDESK_RATE_LIMIT = int(os.getenv("FRESHDESK_RATE_LIMIT", "50"))
+SEND_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+# Process-wide cap on in-flight Freshdesk POSTs across all concurrent bulk runs
+BULKHEAD_SIZE = int(os.getenv("BULKHEAD_SIZE", "32"))
+BULKHEAD_TIMEOUT = 30.0
+
+# Consecutive Freshdesk failures (5xx, auth, network) before sends short-circuit
+BREAKER_FAIL_MAX = 5
+BREAKER_RESET_TIMEOUT = 60.0
+
+# Error bodies (e.g. HTML error pages) are read and reported only up to this size
+MAX_ERROR_BODY = 16 * 1024
+
+# Shared keep-alive session for sync Freshdesk calls
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=20,
+        pool_maxsize=20,
+        # GET only: retrying a POST on 5xx could create duplicate tickets.
+        # Retry-After is ignored so a slow 429 can't pin a threadpool worker.
+        max_retries=Retry(
+            total=3,
+            backoff_factor=1,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=["GET"],
+            respect_retry_after_header=False,
+            # Return the final response so callers report Freshdesk's own status and body
+            raise_on_status=False,
+        ),
+    ),
+)
+
+def template_fields(template: str) -> Set[str]:
+    """Column names referenced by `{placeholder}`s in a str.format template.
+
+    Raises ValueError for placeholders a RowTemplate can't render as written:
+    empty or positional fields, attribute/index access, conversions and format specs.
+    """
+    fields = set()
+    for _, field, spec, conversion in string.Formatter().parse(template):
+        if field is None:
+            continue
+        if not field or field.isdigit():
+            raise ValueError("placeholders must name a column, e.g. {email}")
+        if "." in field or "[" in field:
+            raise ValueError(f"attribute or index access is not supported: {{{field}}}")
+        if conversion or spec:
+            raise ValueError(f"conversions and format specs are not supported: {{{field}}}")
+        fields.add(field)
+    return fields
+
+class RowTemplate(string.Template):
+    # Column names may contain spaces/punctuation, e.g. ${First Name}
+    braceidpattern = r"[^{}]+"
+
+def compile_template(template: str) -> RowTemplate:
+    """Translate a `{placeholder}` template validated by template_fields into a RowTemplate."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(literal.replace("$", "$$"))
+        if field is not None:
+            parts.append("${%s}" % field)
+    return RowTemplate("".join(parts))
 
 def freshdesk_get(endpoint: str) -> requests.Response:
-    url = f"{BASE_URL}/{endpoint}"
+    env = _env()
+    url = f"{env.base_url}/{endpoint}"
     try:
-        resp = requests.get(url, auth=AUTH, headers=HEADERS, timeout=15)
-    except requests.RequestException as exc:
+        # Streamed so an error body can be truncated instead of read in full
+        resp = SESSION.get(url, auth=env.auth, headers=env.headers, timeout=15, stream=True)
+        if not resp.ok:
+            try:
+                detail = resp.raw.read(MAX_ERROR_BODY, decode_content=True)
+            finally:
+                resp.close()
+            raise HTTPException(
+                status_code=resp.status_code,
+                detail=detail.decode(resp.encoding or "utf-8", errors="replace"),
+            )
+    # Reading resp.raw directly surfaces urllib3 errors that requests would otherwise wrap
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as exc:
         raise HTTPException(status_code=502, detail=str(exc))
     return resp
 
-def send_ticket(
+async def read_error_body(resp: httpx.Response) -> str:
+    """Read at most MAX_ERROR_BODY bytes of a streamed error response."""
+    body = bytearray()
+    async for chunk in resp.aiter_bytes():
+        body += chunk
+        if len(body) >= MAX_ERROR_BODY:
+            break
+    return body[:MAX_ERROR_BODY].decode(resp.encoding or "utf-8", errors="replace")
+
+class TokenBucket:
+    """Async token bucket: allows `rate` acquisitions per `per` seconds, bursting up to `burst`."""
+
+    def __init__(self, rate: int, per: float, burst: int = 1) -> None:
+        # A small burst keeps any `per`-second window close to `rate` calls;
+        # a full bucket of `rate` tokens would allow ~2x rate in the first window
+        self.capacity = float(burst)
+        self.fill_rate = rate / per
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.fill_rate)
+
+    async def __aenter__(self) -> "TokenBucket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+RATE_LIMITER = TokenBucket(FRESHDESK_RATE_LIMIT, 60)
+
+class CircuitOpenError(Exception):
+    pass
+
+class CircuitBreaker:
+    """Opens after `fail_max` consecutive failures; lets one probe through every `reset_timeout` seconds."""
+
+    def __init__(self, fail_max: int, reset_timeout: float) -> None:
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.half_open = False
+
+    def before_call(self) -> bool:
+        """Raise while open; return True if the caller is the half-open probe."""
+        if self.opened_at is None:
+            return False
+        if self.half_open or time.monotonic() - self.opened_at < self.reset_timeout:
+            raise CircuitOpenError("Freshdesk circuit open after repeated failures")
+        # Half-open: this call is the probe, others stay rejected until it reports back
+        self.half_open = True
+        return True
+
+    def end_probe(self) -> None:
+        # Probe ended without a verdict (cancelled, non-HTTP error): let the next call probe
+        self.half_open = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.half_open = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.half_open = False
+        if self.failures >= self.fail_max:
+            if self.opened_at is None:
+                logger.error("Freshdesk circuit opened after %d consecutive failures", self.failures)
+            self.opened_at = time.monotonic()
+
+FRESHDESK_BREAKER = CircuitBreaker(BREAKER_FAIL_MAX, BREAKER_RESET_TIMEOUT)
+
+class BulkheadFullError(Exception):
+    pass
+
+FRESHDESK_BULKHEAD = asyncio.Semaphore(BULKHEAD_SIZE)
+
+def retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    """Honor Retry-After when present, else exponential backoff; both capped and jittered."""
+    jitter = random.uniform(0, 1)
+    if retry_after and retry_after.strip().isdigit():
+        return min(RETRY_MAX_DELAY, int(retry_after)) + jitter
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt) + jitter
+
+async def send_ticket(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
     email: str,
     subject: str,
     body: str,
     custom_fields: Dict[str, Any],
 ) -> Dict[str, Any]:
-    url = f"{BASE_URL}/tickets"
+    url = f"{_env().base_url}/tickets"
     payload = {
         "email": email,
         "subject": subject,
@@ -91,23 +302,139 @@ def send_ticket(
         "custom_fields": custom_fields,
     }
 
-    resp = requests.post(
-        url,
-        json=payload,
-        auth=AUTH,
-        headers=HEADERS,
-        timeout=30,
-    )
+    data = orjson.dumps(payload)
 
-    if not resp.ok:
-        raise HTTPException(status_code=resp.status_code, detail=resp.text)
+    async with semaphore:
+        probe = False
+        try:
+            for attempt in range(SEND_MAX_RETRIES + 1):
+                probe = FRESHDESK_BREAKER.before_call()
+                # Wait (bounded) for a process-wide slot before spending a rate-limit
+                # token, so a row that times out here never burns quota
+                try:
+                    await asyncio.wait_for(FRESHDESK_BULKHEAD.acquire(), BULKHEAD_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise BulkheadFullError(
+                        f"No Freshdesk slot free within {BULKHEAD_TIMEOUT:.0f}s; server busy"
+                    ) from None
+                try:
+                    async with RATE_LIMITER:
+                        # Content-Type: application/json comes from the client's default headers
+                        async with client.stream("POST", url, content=data) as resp:
+                            if resp.status_code < 400:
+                                await resp.aread()
+                            else:
+                                error_body = await read_error_body(resp)
+                except httpx.RequestError:
+                    FRESHDESK_BREAKER.record_failure()
+                    raise
+                finally:
+                    FRESHDESK_BULKHEAD.release()
+                # Freshdesk answered: only 5xx and auth errors count against its health;
+                # row-level 4xx (bad email, invalid field) and 429 close the breaker,
+                # so a probe's own 429 retry goes through
+                if resp.status_code >= 500 or resp.status_code in (401, 403):
+                    FRESHDESK_BREAKER.record_failure()
+                else:
+                    FRESHDESK_BREAKER.record_success()
+                probe = False
+                if resp.status_code == 429 and attempt < SEND_MAX_RETRIES:
+                    delay = retry_delay(resp.headers.get("Retry-After"), attempt)
+                elif resp.status_code >= 400:
+                    raise HTTPException(status_code=resp.status_code, detail=error_body)
+                else:
+                    return resp.json()
+                logger.warning("Rate limited for %s, retrying in %.1fs (attempt %d)", email, delay, attempt + 1)
+                await asyncio.sleep(delay)
+        finally:
+            if probe:
+                FRESHDESK_BREAKER.end_probe()
 
-    return resp.json()
+async def send_row(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    row: int,
+    email: str,
+    subject: str,
+    body: str,
+    custom_fields: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Send one ticket and return its per-row result instead of raising."""
+    try:
+        ticket = await send_ticket(
+            client,
+            semaphore,
+            email=email,
+            subject=subject,
+            body=body,
+            custom_fields=custom_fields,
+        )
+    except CircuitOpenError as e:
+        return {"row": row, "email": email, "status": "circuit_open", "error": str(e)}
+    except Exception as e:
+        logger.error("Failed for %s: %s", email, e)
+        return {"row": row, "email": email, "status": "error", "error": str(e)}
+    return {"row": row, "email": email, "status": "sent", "ticket_id": ticket.get("id")}
+
+# ---------------------------------------------------
+# File parsing
+# ---------------------------------------------------
+
+# Quoted cells may span lines (multi-line notes/body columns)
+CSV_PARSE_OPTIONS = pac.ParseOptions(newlines_in_values=True)
+
+def read_table(source: BinaryIO, filename: str) -> pd.DataFrame:
+    if filename.endswith(".csv"):
+        try:
+            return pac.read_csv(source, parse_options=CSV_PARSE_OPTIONS).to_pandas()
+        except pa.ArrowInvalid as e:
+            # pyarrow rejects files pandas tolerates, e.g. rows shorter than the header
+            logger.info("pyarrow could not parse %s (%s); falling back to pandas", filename, e)
+            source.seek(0)
+            return pd.read_csv(source)
+    return pd.read_excel(source, engine="calamine")
+
+def custom_field_value(value: Any, text: str) -> Any:
+    """JSON-ready custom field value: numbers and booleans keep their type, anything else is sent as text."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        # Integer columns with blank cells are parsed as float; send 5, not 5.0
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    return text
 
 # ---------------------------------------------------
 # Routes
 # ---------------------------------------------------
 
+@app.on_event("startup")
+def startup_checks():
+    env = _env()
+    # One pooled HTTP/2 client for all ticket POSTs in this worker
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        auth=env.auth,
+        headers=env.headers,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        timeout=30,
+    )
+    logger.info(
+        "Freshdesk config: domain=%s, base_url=%s, api_key=%s",
+        mask(env.domain),
+        env.base_url,
+        mask(env.api_key),
+    )
+    if not env.api_key or len(env.api_key) < 10:
+        logger.warning("FRESHDESK_API_KEY is missing or too short; /send-bulk will refuse requests")
+
+@app.on_event("shutdown")
+async def shutdown():
+    await app.state.http.aclose()
+
 @app.get("/")
 def root():
     """Health check for Cloud Run."""
@@ -115,13 +442,11 @@ def root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "ok", "env_domain": mask(FRESHDESK_DOMAIN)}
+    return {"status": "ok", "env_domain": mask(_env().domain)}
 
 @app.get("/ticket-fields")
 def ticket_fields():
     resp = freshdesk_get("ticket_fields")
-    if not resp.ok:
-        raise HTTPException(status_code=resp.status_code, detail=resp.text)
     data = resp.json()
     simplified = []
     for f in data:
@@ -142,7 +467,8 @@ async def send_bulk_email(
     disposition: str = Form(""),
     custom_fields_json: str = Form(""),
 ):
-    if not FRESHDESK_API_KEY or len(FRESHDESK_API_KEY) < 10:
+    env = _env()
+    if not env.api_key or len(env.api_key) < 10:
         raise HTTPException(status_code=500, detail="Server misconfiguration: Invalid API Key")
 
     logger.info(
@@ -153,19 +479,26 @@ async def send_bulk_email(
         email_column,
     )
 
-    contents = await file.read()
     filename = file.filename or ""
 
     try:
-        if filename.endswith(".csv"):
-            df = pd.read_csv(BytesIO(contents))
-        else:
-            df = pd.read_excel(BytesIO(contents))
+        # Starlette has already spooled the upload (to disk once it's large), so
+        # parse its file object directly; parsing is CPU-bound and blocking,
+        # so it runs off the event loop
+        df = await asyncio.to_thread(read_table, file.file, filename)
     except Exception as e:
         logger.error("Error parsing file: %s", e)
         raise HTTPException(status_code=400, detail=f"Invalid file format: {e}")
 
-    df.columns = [c.strip() for c in df.columns]
+    df.columns = df.columns.astype(str).str.strip()
+
+    # pyarrow keeps repeated headers as-is (pandas used to rename them to "name.1")
+    duplicates = sorted(set(df.columns[df.columns.duplicated()]))
+    if duplicates:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Duplicate column names in file: {duplicates}",
+        )
 
     if email_column not in df.columns:
         raise HTTPException(
@@ -173,72 +506,110 @@ async def send_bulk_email(
             detail=f"Column '{email_column}' not found. Available: {list(df.columns)}",
         )
 
-    results = []
-    
+    # Resolve template placeholders once instead of catching KeyError per row
+    try:
+        placeholders = template_fields(subject_template) | template_fields(body_template)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid template: {e}")
+    missing = placeholders - set(df.columns)
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Template placeholders not found in file: {sorted(missing)}",
+        )
+
+    # Placeholders are validated, so per-row rendering is a plain substitution
+    subject_tmpl = compile_template(subject_template)
+    body_tmpl = compile_template(body_template)
+
+    df = df.reset_index(drop=True)
+    # Stringify the whole frame once (NaN -> "") for rendering instead of per cell in the loop
+    text_df = df.fillna("").astype(str)
+
+    # Strip emails column-wise and split off rows without one up front
+    text_df[email_column] = text_df[email_column].str.strip()
+    has_email = text_df[email_column] != ""
+    skipped = [
+        {"row": int(i) + 1, "email": "", "status": "skipped", "reason": "no email"}
+        for i in text_df.index[~has_email]
+    ]
+
     # Identify custom fields (columns that are NOT email)
     # We ignore specific system fields if needed
     ignored_fields = {"company", "company_id", email_column}
-    
-    for idx, row in df.iterrows():
-        recipient_email = str(row[email_column]).strip()
-        
-        # Build custom_fields dict for this row
-        # Only include columns that actually exist in the row
-        row_custom_fields = {}
-        for col in df.columns:
-            if col.startswith("cf_") and col not in ignored_fields:
-                val = row[col]
-                if pd.notna(val) and str(val).strip() != "":
-                    row_custom_fields[col] = val
-        # Merge dynamic custom fields from form
-        extra_fields: Dict[str, Any] = {}
-        if custom_fields_json:
-            try:
-                parsed = json.loads(custom_fields_json)
-                if isinstance(parsed, dict):
-                    extra_fields = parsed
-            except Exception as e:
-                logger.warning(f"Invalid custom_fields_json: {e}")
-        # Attach disposition if provided
-        if disposition:
-            extra_fields["cf_choose_your_inquiry"] = disposition
-        extra_fields = {k: v for k, v in extra_fields.items() if isinstance(k, str) and k.startswith("cf_")}
-        # Merge with precedence to extra_fields
-        row_custom_fields = {**row_custom_fields, **extra_fields}
-
-        # Simple template substitution
-        # This replaces {name} with row['name'], etc.
-        # We use a safe substitution that doesn't crash on missing keys
-        row_dict = row.to_dict()
-        # Convert all to string for safe formatting
-        safe_row = {k: str(v) for k, v in row_dict.items()}
-        
-        try:
-            final_subject = subject_template.format(**safe_row)
-            final_body = body_template.format(**safe_row)
-        except KeyError as e:
-            # If template has {missing_col}, it might fail
-            # We'll just leave it or fail? Let's fail safe
-            final_subject = subject_template
-            final_body = body_template
-            logger.warning(f"Template key error: {e}")
+    columns = list(df.columns)
+    cf_columns = [c for c in columns if c.startswith("cf_") and c not in ignored_fields]
+    cf_positions = [(c, columns.index(c)) for c in cf_columns]
 
+    # Dynamic custom fields from the form are identical for every row
+    extra_fields: Dict[str, Any] = {}
+    if custom_fields_json:
         try:
-            # -------------------------------------------------
-            # SEND TO FRESHDESK
-            # -------------------------------------------------
-            send_ticket(
-                email=recipient_email,
-                subject=final_subject,
-                body=final_body,
-                custom_fields=row_custom_fields
-            )
-            results.append({"email": recipient_email, "status": "sent"})
+            parsed = json.loads(custom_fields_json)
+            if isinstance(parsed, dict):
+                extra_fields = parsed
         except Exception as e:
-            logger.error("Failed for %s: %s", recipient_email, e)
-            results.append({"email": recipient_email, "status": "error", "error": str(e)})
+            logger.warning(f"Invalid custom_fields_json: {e}")
+    # Attach disposition if provided
+    if disposition:
+        extra_fields["cf_choose_your_inquiry"] = disposition
+    extra_fields = {k: v for k, v in extra_fields.items() if isinstance(k, str) and k.startswith("cf_")}
+
+    def iter_jobs():
+        # Walk both frames row by row; per-row dicts are built only as rows are sent
+        rows = zip(
+            has_email,
+            text_df.itertuples(index=False, name=None),
+            df.itertuples(index=False, name=None),
+        )
+        for index, (keep, text_values, typed_values) in enumerate(rows):
+            if not keep:
+                continue
+            row_dict = dict(zip(columns, text_values))
+            recipient_email = row_dict[email_column]
+
+            # Non-empty cf_ cells, then form fields with precedence. Values come
+            # from the typed frame so numbers go out as JSON numbers
+            row_custom_fields = {
+                c: custom_field_value(typed_values[i], row_dict[c])
+                for c, i in cf_positions
+                if row_dict[c].strip()
+            }
+            row_custom_fields.update(extra_fields)
+
+            # Simple template substitution
+            # This replaces {name} with row['name'], etc.
+            final_subject = subject_tmpl.safe_substitute(row_dict)
+            final_body = body_tmpl.safe_substitute(row_dict)
 
-        # Rate limit (avoid 429)
-        time.sleep(0.5)
+            yield index + 1, recipient_email, final_subject, final_body, row_custom_fields
+
+    # -------------------------------------------------
+    # SEND TO FRESHDESK (sliding window, capped by semaphore)
+    # Rows are rendered lazily and each result is streamed as one NDJSON
+    # line as soon as it completes. The parsed frame and its stringified
+    # copy stay in memory for the whole run; rendered rows, tasks and
+    # results are bounded by the window
+    # -------------------------------------------------
+    async def generate() -> AsyncIterator[bytes]:
+        semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+        client = app.state.http
+        pending: Set[asyncio.Future] = set()
+        for result in skipped:
+            yield orjson.dumps(result) + b"\n"
+        try:
+            for job in iter_jobs():
+                pending.add(asyncio.ensure_future(send_row(client, semaphore, *job)))
+                if len(pending) < SEND_WINDOW_SIZE:
+                    continue
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield orjson.dumps(task.result()) + b"\n"
+            for next_done in asyncio.as_completed(pending):
+                yield orjson.dumps(await next_done) + b"\n"
+        finally:
+            # Stops pending sends if the client disconnects mid-stream
+            for task in pending:
+                task.cancel()
 
-    return {"processed": len(results), "details": results}
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
@@ -3,7 +3,7 @@ import axios from "axios";
 
 type ResultRow = {
   row: number;
-  status: "sent" | "skipped" | "error";
+  status: "sent" | "skipped" | "error" | "circuit_open";
   ticket_id?: number;
   reason?: string;
   error?: string | Record<string, unknown>;
@@ -152,30 +152,36 @@ const BulkMailer = () => {
 
     setSending(true);
     try {
-      const res = await axios.post<any>(API_BASE, formData, {
-        headers: { "Content-Type": "multipart/form-data" },
-      });
-      const data = res.data as any;
-      const results: ResultRow[] = Array.isArray(data?.results)
-        ? data.results
-        : Array.isArray(data?.details)
-          ? data.details.map((r: any, idx: number) => ({
-              row: idx + 1,
-              status: r?.status ?? "error",
-              ticket_id: r?.ticket_id,
-              reason: r?.reason,
-              error: r?.error,
-            }))
-          : [];
-
-      const total =
-        typeof data?.total === "number"
-          ? data.total
-          : typeof data?.processed === "number"
-            ? data.processed
-            : results.length;
-
-      setResponse({ total, results });
+      // Axios buffers the whole body, so use fetch to read NDJSON lines as they arrive
+      const res = await fetch(API_BASE, { method: "POST", body: formData });
+      if (!res.ok || !res.body) {
+        const data = await res.json().catch(() => null);
+        throw new Error(
+          typeof data?.detail === "string"
+            ? data.detail
+            : data?.detail
+              ? JSON.stringify(data.detail)
+              : `Request failed with status ${res.status}`
+        );
+      }
+
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      const results: ResultRow[] = [];
+      let buffered = "";
+      setResponse({ total: 0, results: [] });
+
+      while (true) {
+        const { done, value } = await reader.read();
+        buffered += decoder.decode(value, { stream: !done });
+        const lines = buffered.split("\n");
+        buffered = done ? "" : lines.pop() ?? "";
+        for (const line of lines) {
+          if (line.trim()) results.push(JSON.parse(line) as ResultRow);
+        }
+        setResponse({ total: results.length, results: [...results] });
+        if (done) break;
+      }
     } catch (err: any) {
       const message =
         err.response?.data?.detail ||